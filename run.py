@@ -1,140 +1,1006 @@
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import mmap
 import os
+import pickle
+import re
 import shutil
+import sys
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+from collections import namedtuple
 
 PROJECT_ROOT = Path.cwd()
 SRC_DIR = PROJECT_ROOT / "src"
 BUILD_ROOT = PROJECT_ROOT / "build"
 PDF_ROOT = PROJECT_ROOT / "pdfs"
 LOG_ROOT = PROJECT_ROOT / "logs"
+CACHE_FILE = PROJECT_ROOT / ".build-cache"
+
+# Binary assets are fingerprinted by (size, mtime) instead of content
+# to avoid hashing megabytes of image data on every run.
+BINARY_SUFFIXES = {".png", ".jpg", ".jpeg", ".pdf"}
+
+# ANSI status colors, blanked when output is piped (CI logs stay
+# grep-friendly) or the user sets NO_COLOR.
+if sys.stdout.isatty() and not os.environ.get("NO_COLOR"):
+    GREEN, RED, RESET = "\033[32m", "\033[31m", "\033[0m"
+else:
+    GREEN = RED = RESET = ""
+
+
+# --------------------------------------------------
+# Build cache
+# --------------------------------------------------
+
+class BuildCache:
+    """
+    Tracks per-file mtimes and content hashes between runs.
+
+    The mtime is only a fast-path gate: when it differs from the cached
+    value, the SHA-256 content hash decides whether the file really
+    changed. This avoids spurious rebuilds after `touch` or a fresh
+    `git checkout`, where mtimes reset but content does not.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.data = {"version": self.VERSION, "mtimes": {}, "hashes": {}}
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == self.VERSION:
+                self.data = data
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            # Missing, truncated (EOFError on an empty file) or
+            # otherwise unreadable: start from scratch.
+            pass
+        self.data.setdefault("durations", {})
+        self._dirty = False
+
+    def save(self):
+        # Pickle, not JSON: the cache is an internal artifact, and
+        # binary serialization avoids the indent/str round-trip cost.
+        # Dump to a sibling temp file and rename so an interrupt never
+        # leaves a half-written cache behind.
+        if not self._dirty:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.data, f, protocol=5)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def export_json(self):
+        return json.dumps(self.data, indent=2)
+
+    @staticmethod
+    def fingerprint(path, st=None):
+        if st is None:
+            st = os.stat(path)
+        if Path(path).suffix.lower() in BINARY_SUFFIXES:
+            return f"{st.st_size}:{st.st_mtime}"
+        return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+    def has_changed(self, path):
+        key = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+
+        if self.data["mtimes"].get(key) == st.st_mtime:
+            return False
+
+        if self.data["hashes"].get(key) == self.fingerprint(path, st):
+            # Touched but identical: refresh the mtime gate and move on.
+            self.data["mtimes"][key] = st.st_mtime
+            self._dirty = True
+            return False
+
+        return True
+
+    def get_duration(self, path):
+        return self.data["durations"].get(str(path))
+
+    def set_duration(self, path, seconds):
+        self.data["durations"][str(path)] = seconds
+        self._dirty = True
+
+    def update(self, path):
+        key = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self.data["mtimes"][key] = st.st_mtime
+        self.data["hashes"][key] = self.fingerprint(path, st)
+        self._dirty = True
 
 
 # --------------------------------------------------
 # File discovery
 # --------------------------------------------------
 
-def find_main_tex_files(root, suffix="_main.tex", exclude_patterns=None):
-    if exclude_patterns is None:
-        exclude_patterns = []
+# Directory names never descended into during discovery. Pruning whole
+# subtrees by name replaces the old per-file substring post-filter.
+PRUNE_DIRS = {"build", "pdfs", "logs", "legacy", "templates", "tmp", "temp",
+              ".git", ".venv", "__pycache__"}
+
 
+def find_main_tex_files(root, suffix="_main.tex"):
     files = []
-    for path in root.rglob(f"*{suffix}"):
-        path_str = str(path)
-        if any(pat in path_str for pat in exclude_patterns):
-            continue
-        files.append(path)
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in PRUNE_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    files.append(Path(entry.path))
 
+    files.sort()
     return files
 
 
+# --------------------------------------------------
+# Module discovery
+# --------------------------------------------------
+
+# Course codes look like HAI802I; compiled once, searched once per module.
+_CODE_RE = re.compile(r"HAI(\d+)I")
+
+
+class ModuleInfo:
+    def __init__(self, name, root):
+        self.name = name
+        self.root = root
+        m = _CODE_RE.search(name)
+        self.code = m.group(1) if m else None
+        self.files = []
+
+
+def filter_modules(modules, patterns):
+    """
+    Resolve user-supplied patterns to modules. Exact directory names
+    and course codes hit precomputed dicts; anything else falls back
+    to a case-insensitive substring scan. Lowercasing happens once
+    per module and once per pattern, not per comparison.
+    """
+    by_name = dict(modules)
+    by_code = {m.code: m for m in modules.values() if m.code}
+    lower_pairs = [(name.lower(), mod) for name, mod in modules.items()]
+
+    selected = {}
+    unmatched = []
+    for pattern in patterns:
+        mod = by_name.get(pattern) or by_code.get(pattern)
+        if mod is not None:
+            selected[mod.name] = mod
+            continue
+        pattern_lower = pattern.lower()
+        hits = [mod for name, mod in lower_pairs if pattern_lower in name]
+        if hits:
+            for mod in hits:
+                selected[mod.name] = mod
+        else:
+            unmatched.append(pattern)
+    return selected, unmatched
+
+
+def discover_modules(tex_files):
+    """Group main tex files by their top-level module under src/."""
+    modules = {}
+    for tex_file in tex_files:
+        root = module_root_for(tex_file) or SRC_DIR
+        mod = modules.get(root.name)
+        if mod is None:
+            mod = modules[root.name] = ModuleInfo(root.name, root)
+        mod.files.append(tex_file)
+    return modules
+
+
 # --------------------------------------------------
 # Path helpers
 # --------------------------------------------------
 
-def mirror_under(root_dir, src_file):
+def ensure_dir(directory):
     """
-    Mirrors src/... under root_dir/...
-    Example:
-      src/ch1/sec1/main.tex
-      -> build/ch1/sec1/
+    EAFP mkdir: try the leaf first and only recurse to parents on
+    FileNotFoundError. On repeat builds, where the tree already
+    exists, this costs one syscall instead of a stat per component.
     """
-    rel = src_file.parent.relative_to(SRC_DIR)
-    target = root_dir / rel
-    target.mkdir(parents=True, exist_ok=True)
-    return target
+    try:
+        os.mkdir(directory)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        ensure_dir(directory.parent)
+        os.mkdir(directory)
+
+
+TexPaths = namedtuple(
+    "TexPaths", ["build_dir", "pdf_dir", "log_dir", "pdf_file", "fls_file"]
+)
+
+
+@functools.lru_cache(maxsize=None)
+def paths_for(tex_file):
+    """
+    All derived paths for a main tex file, computed once per file.
+    The output trees mirror src/:
+      src/ch1/sec1/main.tex -> build/ch1/sec1/, pdfs/ch1/sec1/, ...
+    """
+    rel = tex_file.parent.relative_to(SRC_DIR)
+    build_dir = BUILD_ROOT / rel
+    stem = tex_file.stem
+    return TexPaths(
+        build_dir=build_dir,
+        pdf_dir=PDF_ROOT / rel,
+        log_dir=LOG_ROOT / rel,
+        pdf_file=PDF_ROOT / rel / f"{stem}.pdf",
+        fls_file=build_dir / f"{stem}.fls",
+    )
+
+
+# --------------------------------------------------
+# Dependency discovery
+# --------------------------------------------------
+
+# Suffixes that can influence a compiled PDF.
+DEP_SUFFIXES = {".tex", ".sty", ".cls", ".png", ".jpg", ".jpeg", ".pdf"}
+
+COMMON_DIR = SRC_DIR / "common"
+
+# Each subtree is walked at most once per run; every main file in the
+# same module reuses the result instead of re-globbing the tree.
+_scan_cache = {}
+
+
+def scan_tree(root):
+    """
+    Returns a list of (path, mtime) for dependency files under root.
+
+    The mtime comes from the DirEntry produced by os.scandir, so the
+    whole subtree costs one directory read per level and no per-file
+    stat syscalls.
+    """
+    try:
+        return _scan_cache[root]
+    except KeyError:
+        pass
+
+    found = []
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1] in DEP_SUFFIXES:
+                    found.append((Path(entry.path), entry.stat().st_mtime))
+
+    _scan_cache[root] = found
+    return found
+
+
+# Lines of interest in a latexmk .fls recorder file.
+_FLS_INPUT_RE = re.compile(
+    rb"^INPUT (.+\.(?:tex|sty|cls|png|jpe?g|pdf))$", re.MULTILINE
+)
+
+
+def parse_fls_dependencies(fls_file, base_dir):
+    """
+    Input files recorded by latexmk during the last build. Relative
+    paths are resolved against the directory the compile ran in.
+    Matching happens with one compiled regex over the mmap'd file
+    instead of a Python-level loop per line.
+    """
+    deps = set()
+    with open(fls_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return deps
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for m in _FLS_INPUT_RE.finditer(mm):
+                dep = Path(os.fsdecode(m.group(1)))
+                if not dep.is_absolute():
+                    dep = base_dir / dep
+                # Normalize ../ segments (string-only, no syscalls) so
+                # the same file always maps to one cache key.
+                deps.add(Path(os.path.normpath(dep)))
+    return deps
+
+
+def module_root_for(tex_file):
+    rel = tex_file.relative_to(SRC_DIR)
+    if len(rel.parts) == 1:
+        # Main file sits directly under src/: there is no module
+        # subtree, and treating src/ itself as one would drag the
+        # whole source tree into the dependency set.
+        return None
+    return SRC_DIR / rel.parts[0]
+
+
+@functools.lru_cache(maxsize=None)
+def max_tree_mtime(root):
+    """Newest mtime in a subtree, computed once per run from scan_tree."""
+    return max((mt for _, mt in scan_tree(root)), default=0.0)
+
+
+def max_dep_mtime(tex_file):
+    """Coarse aggregate: newest mtime among the heuristic dependencies."""
+    newest = max_tree_mtime(COMMON_DIR)
+    module_root = module_root_for(tex_file)
+    if module_root is not None:
+        newest = max(newest, max_tree_mtime(module_root))
+    return newest
+
+
+# Include-like commands whose target could be another main's source
+# or output (\includepdf of a generated PDF, \input of a main).
+_XREF_RE = re.compile(
+    rb"\\(?:includepdf|input|include)(?:\[[^\]]*\])?\{([^}]+)\}"
+)
+
+
+def _is_commented(line_prefix):
+    """True if the prefix contains an unescaped % (TeX comment)."""
+    idx = line_prefix.find(b"%")
+    while idx != -1:
+        if idx == 0 or line_prefix[idx - 1:idx] != b"\\":
+            return True
+        idx = line_prefix.find(b"%", idx + 1)
+    return False
+
+
+def scan_xrefs(tex_file):
+    """
+    Include-like targets of a main file, found in one compiled-regex
+    pass over the mmap'd bytes - no line splitting, no str decode of
+    the whole file. Matches on commented-out lines are dropped, or a
+    disabled \\includepdf would create a phantom dependency edge.
+    """
+    targets = []
+    with open(tex_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return targets
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for m in _XREF_RE.finditer(mm):
+                line_start = mm.rfind(b"\n", 0, m.start()) + 1
+                if _is_commented(mm[line_start:m.start()]):
+                    continue
+                targets.append(Path(os.fsdecode(m.group(1))))
+    return targets
+
+
+def main_file_graph(tex_files):
+    """
+    Dependency edges between main files: a main that embeds another
+    main's PDF (or source) must compile after its producer. Returns
+    (graph, dependents) where graph maps each file to its producers.
+    Independent files - the normal case - have no edges at all.
+    """
+    mains = set(tex_files)
+    producer_of = {paths_for(t).pdf_file: t for t in mains}
+    producer_of.update({t: t for t in mains})
+
+    # The scans are independent mmap+regex passes; overlap the reads.
+    with ThreadPoolExecutor(
+        max_workers=min(32, (os.cpu_count() or 1) * 4)
+    ) as executor:
+        xrefs = dict(zip(tex_files, executor.map(scan_xrefs, tex_files)))
+
+    graph = {t: set() for t in tex_files}
+    for tex_file in tex_files:
+        for target in xrefs[tex_file]:
+            if not target.is_absolute():
+                target = (tex_file.parent / target).resolve()
+            for candidate in (
+                target,
+                target.with_suffix(".tex") if not target.suffix else target,
+                target.with_suffix(".pdf") if not target.suffix else target,
+            ):
+                dep = producer_of.get(candidate)
+                if dep is not None and dep != tex_file:
+                    graph[tex_file].add(dep)
+
+    dependents = {t: [] for t in tex_files}
+    for t, deps in graph.items():
+        for dep in deps:
+            dependents[dep].append(t)
+
+    return graph, dependents
+
+
+# --------------------------------------------------
+# Rebuild decisions
+# --------------------------------------------------
+
+def _mtime(path, _stat=os.stat):
+    """mtime in one stat syscall, or None if the file is missing."""
+    try:
+        return _stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def scan_pdf_mtimes():
+    """One scan of pdfs/ shared by every needs_rebuild call."""
+    try:
+        return dict(scan_tree(PDF_ROOT))
+    except FileNotFoundError:
+        return {}
+
+
+def _gate_covers(dep, module_root):
+    """
+    True when dep lies in a subtree the coarse mtime gate aggregates
+    over. Files outside the project (TeX system trees) count as
+    covered: they are effectively immutable.
+    """
+    dep_str = os.fspath(dep)
+    if not dep_str.startswith(f"{PROJECT_ROOT}{os.sep}"):
+        return True
+    if dep_str.startswith(f"{COMMON_DIR}{os.sep}"):
+        return True
+    return (module_root is not None
+            and dep_str.startswith(f"{module_root}{os.sep}"))
+
+
+def needs_rebuild(tex_file, cache, pdf_mtimes):
+    paths = paths_for(tex_file)
+    pdf_mtime = pdf_mtimes.get(paths.pdf_file)
+    if pdf_mtime is None:
+        return True
+    if cache.has_changed(tex_file):
+        return True
+
+    if paths.fls_file.exists():
+        fls_deps = parse_fls_dependencies(paths.fls_file, tex_file.parent)
+    else:
+        fls_deps = None
+
+    # Coarse gate first: one aggregate per module, shared by every main
+    # in it. It only covers common/ and the module subtree, so recorded
+    # inputs outside both - another module's published PDF pulled in
+    # with \includepdf - are still checked individually below.
+    if max_dep_mtime(tex_file) <= pdf_mtime:
+        if fls_deps is None:
+            return False
+        module_root = module_root_for(tex_file)
+        for dep in fls_deps:
+            if _gate_covers(dep, module_root):
+                continue
+            dep_mtime = _mtime(dep)
+            if (dep_mtime is not None and dep_mtime > pdf_mtime
+                    and cache.has_changed(dep)):
+                return True
+        return False
+
+    # Something in the module changed; consult the recorder file for a
+    # precise answer (it lists exactly what the last build read). The
+    # mtime comparison is only a filter: a dep that merely got touched
+    # still has to fail the content check before it forces a rebuild.
+    if fls_deps is not None:
+        for dep in fls_deps:
+            dep_mtime = _mtime(dep)
+            if (dep_mtime is not None and dep_mtime > pdf_mtime
+                    and cache.has_changed(dep)):
+                return True
+        return False
+
+    # No recorder file yet (first build): the coarse signal decides.
+    return True
 
 
 # --------------------------------------------------
 # Compilation
 # --------------------------------------------------
 
-def compile_latex(tex_file: Path):
+LATEXMK = "latexmk"
+# No -shell-escape: nothing in src/ uses minted or externalized TikZ,
+# and leaving it off lets pdflatex keep its restricted-mode fast paths.
+# SyncTeX is editor plumbing with no value in a batch build.
+LATEXMK_FLAGS = (
+    "-pdf",
+    "-interaction=nonstopmode",
+    "-halt-on-error",
+    "-synctex=0",
+    "-file-line-error",
+    # Explicit, although it is latexmk's default: needs_rebuild depends
+    # on the .fls recorder files being written.
+    "-recorder",
+    # Mains can \includepdf another main's output; ignore the metadata
+    # lines that change on every compile when latexmk decides whether
+    # an included PDF "changed", or each rebuild triggers a spurious
+    # extra pass downstream.
+    "-e", "$hash_calc_ignore_pattern{'pdf'} = '^/(CreationDate|ModDate|ID)';",
+)
+
+
+def publish_pdf(built_pdf, pdf_output):
+    """
+    Expose the built PDF under pdfs/ via a hardlink (no bytes copied),
+    falling back to a plain copy across filesystems.
+    """
+    try:
+        pdf_output.unlink(missing_ok=True)
+        os.link(built_pdf, pdf_output)
+    except OSError:
+        shutil.copyfile(built_pdf, pdf_output)
+
+# Flags for iterative builds: skip PDF stream compression (pure CPU
+# spent on an artifact nobody archives).
+FAST_FLAGS = (
+    "-pretex=\\pdfcompresslevel=0\\pdfobjcompresslevel=0",
+    "-usepretex",
+)
+
+
+async def _run_latexmk(cmd, cwd, log_file):
+    """
+    Spawn latexmk without a worker thread or shell: the event loop
+    just waits on the child, and the kernel writes its output straight
+    to the log file.
+    """
+    with open(log_file, "wb") as logf:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            stdout=logf,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        return await proc.wait()
+
+
+async def compile_latex(tex_file: Path, extra_flags=()):
     job_name = tex_file.stem
 
-    build_dir = mirror_under(BUILD_ROOT, tex_file)
-    pdf_dir   = mirror_under(PDF_ROOT, tex_file)
-    log_dir   = mirror_under(LOG_ROOT, tex_file)
+    paths = paths_for(tex_file)
+    build_dir, pdf_dir, log_dir = paths.build_dir, paths.pdf_dir, paths.log_dir
 
     cmd = [
-        "latexmk",
-        "-pdf",
-        "-shell-escape",
-        "-interaction=nonstopmode",
-        "-halt-on-error",
+        LATEXMK,
+        *LATEXMK_FLAGS,
+        *extra_flags,
         f"-outdir={build_dir}",
         f"{job_name}.tex",
     ]
 
     try:
-        result = subprocess.run(
-            cmd,
-            cwd=tex_file.parent,     # per-thread working directory
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            check=False
+        returncode = await _run_latexmk(
+            cmd, tex_file.parent, log_dir / f"{job_name}.log"
         )
 
-        # Copy PDF
+        # Publish PDF
         pdf_src = build_dir / f"{job_name}.pdf"
         if pdf_src.exists():
-            shutil.copy2(pdf_src, pdf_dir / pdf_src.name)
+            publish_pdf(pdf_src, pdf_dir / pdf_src.name)
 
-        # Move log
-        log_src = build_dir / f"{job_name}.log"
-        if log_src.exists():
-            shutil.move(log_src, log_dir / log_src.name)
-
-        return result.returncode == 0
+        return returncode == 0
 
     except Exception:
         return False
 
+async def compile_directory(tex_files, extra_flags=()):
+    """
+    Compile main files sharing one directory. With several files, a
+    single latexmk invocation takes them all as targets, paying the
+    perl startup cost once; if that batch fails, each file is retried
+    individually so per-file status stays accurate.
+    """
+    if len(tex_files) == 1:
+        return {tex_files[0]: await compile_latex(tex_files[0], extra_flags)}
+
+    paths = paths_for(tex_files[0])
+
+    cmd = [
+        LATEXMK,
+        *LATEXMK_FLAGS,
+        *extra_flags,
+        f"-outdir={paths.build_dir}",
+        *(f"{tex.stem}.tex" for tex in tex_files),
+    ]
+
+    try:
+        returncode = await _run_latexmk(
+            cmd, tex_files[0].parent, paths.log_dir / "latexmk_batch.log"
+        )
+    except Exception:
+        returncode = None
+
+    if returncode == 0:
+        statuses = {}
+        for tex in tex_files:
+            pdf_src = paths.build_dir / f"{tex.stem}.pdf"
+            if pdf_src.exists():
+                publish_pdf(pdf_src, paths.pdf_dir / pdf_src.name)
+                statuses[tex] = True
+            else:
+                statuses[tex] = False
+        return statuses
+
+    # Batch failed (halt-on-error stops at the first bad file):
+    # recompile one by one to attribute the failure correctly.
+    return {tex: await compile_latex(tex, extra_flags) for tex in tex_files}
+
+
 # --------------------------------------------------
-# Main
+# Commands
 # --------------------------------------------------
 
-if __name__ == "__main__":
-    exclude_patterns = ["legacy", "templates", "tmp", "temp"]
+@functools.lru_cache(maxsize=1)
+def discover_main_files():
+    """Main tex files under src/, walked once per process and memoized."""
+    return tuple(find_main_tex_files(SRC_DIR))
 
-    tex_files = find_main_tex_files(SRC_DIR, "_main.tex", exclude_patterns)
 
-    print("Found the following files to compile:")
-    for f in tex_files:
-        print("  ", f)
+def list_command(args):
+    lines = []
+    for mod in discover_modules(discover_main_files()).values():
+        code = f"HAI{mod.code}I" if mod.code else "no course code"
+        lines.append(f"{mod.name} ({code}):")
+        lines.extend(f"    {f.relative_to(SRC_DIR)}" for f in mod.files)
+    sys.stdout.write("\n".join(lines) + "\n")
+    return 0
 
-    successes = []
-    failures = []
+
+def count_lines(path):
+    # Binary read + bytes.count: no decoding, no per-line str objects.
+    with open(path, "rb") as f:
+        return f.read().count(b"\n")
+
+
+def _walk_and_bucket(root, suffixes):
+    """
+    One scandir walk of root, bucketing files as {suffix: [(path, size)]}.
+    Sizes come from the DirEntry stat, so no extra syscall per file.
+    """
+    buckets = {suffix: [] for suffix in suffixes}
+    if not root.exists():
+        return buckets
+
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                suffix = os.path.splitext(entry.name)[1]
+                if suffix in buckets:
+                    buckets[suffix].append((entry.path, entry.stat().st_size))
+    return buckets
+
+
+def _src_stats(cache):
+    """
+    Source-side aggregates (tex/line/image counts), memoized in the
+    build cache. The signature is (entry count, newest mtime) of the
+    src/ tree; while it matches, the stored totals are reused and the
+    per-file line-counting reads are skipped entirely.
+    """
+    entries = scan_tree(SRC_DIR)
+    signature = (len(entries), max((mt for _, mt in entries), default=0.0))
+
+    stored = cache.data.get("stats")
+    if stored and stored.get("signature") == signature:
+        return stored
+
+    src = _walk_and_bucket(SRC_DIR, (".tex", ".png", ".jpg"))
+    tex_files = src[".tex"]
+
+    # Line counting is pure IO; the GIL is released during reads.
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        total_lines = sum(executor.map(count_lines, (p for p, _ in tex_files)))
+
+    stats = {
+        "signature": signature,
+        "tex_count": len(tex_files),
+        "tex_lines": total_lines,
+        "image_count": len(src[".png"]) + len(src[".jpg"]),
+    }
+    cache.data["stats"] = stats
+    cache._dirty = True
+    cache.save()
+    return stats
+
+
+def stats_command(args):
+    cache = BuildCache()
+    src_stats = _src_stats(cache)
+
+    pdf_files = _walk_and_bucket(PDF_ROOT, (".pdf",))[".pdf"]
+    pdf_size = sum(size for _, size in pdf_files)
+
+    print("===== Project Statistics =====")
+    print(f"Modules:        {len(discover_modules(discover_main_files()))}")
+    print(f"Main files:     {len(discover_main_files())}")
+    print(f"TeX files:      {src_stats['tex_count']}")
+    print(f"TeX lines:      {src_stats['tex_lines']}")
+    print(f"Images:         {src_stats['image_count']}")
+    print(f"Generated PDFs: {len(pdf_files)} ({pdf_size / 1024 / 1024:.1f} MiB)")
+    return 0
+
+
+def _trash_tree(directory):
+    """
+    Make a directory disappear from its path in O(1): rename it to a
+    .trash-* sibling and let a background thread do the actual rmtree.
+    """
+    if not directory.exists():
+        return
+    trash = directory.with_name(f".trash-{uuid.uuid4().hex}")
+    directory.rename(trash)
+    threading.Thread(
+        target=shutil.rmtree, args=(trash,),
+        kwargs={"ignore_errors": True}, daemon=True,
+    ).start()
+
+
+def _sweep_leftover_trash():
+    # Trash from a previous run whose background delete didn't finish.
+    for leftover in PROJECT_ROOT.glob(".trash-*"):
+        shutil.rmtree(leftover, ignore_errors=True)
+
+
+def clean_command(args):
+    _sweep_leftover_trash()
+
+    # Keep build/ by default: the aux/toc/fls state in there is what
+    # lets latexmk skip passes on the next run. --deep wipes it too.
+    targets = [LOG_ROOT]
+    if args.deep:
+        targets.insert(0, BUILD_ROOT)
+    if args.pdfs:
+        targets.append(PDF_ROOT)
+
+    for directory in targets:
+        _trash_tree(directory)
+        print(f"Cleaned {directory.relative_to(PROJECT_ROOT)}/")
+
+    CACHE_FILE.unlink(missing_ok=True)
+    return 0
+
+
+def _remove_published_pdfs(tex_files):
+    """
+    Delete the published PDFs for tex_files, grouped so each output
+    directory is read once instead of once per file.
     """
-    Non parallel version
+    by_dir = {}
     for tex in tex_files:
-        ok = compile_latex(tex)
-        if ok:
-            successes.append(tex)
+        paths = paths_for(tex)
+        by_dir.setdefault(paths.pdf_dir, set()).add(paths.pdf_file.name)
+    for pdf_dir, names in by_dir.items():
+        try:
+            with os.scandir(pdf_dir) as it:
+                for entry in it:
+                    if entry.name in names:
+                        os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def build_command(args):
+    global BUILD_ROOT
+    if getattr(args, "ram_build", False):
+        if os.path.isdir("/dev/shm"):
+            # Intermediate artifacts (.aux/.fls/.fdb_latexmk/...) are
+            # metadata churn nobody keeps; pointing the build tree at
+            # tmpfs keeps that churn off the disk. The published PDF
+            # still lands in pdfs/ (publish_pdf falls back to a copy
+            # across the filesystem boundary).
+            BUILD_ROOT = Path("/dev/shm") / f"m1algo-build-{os.getuid()}"
         else:
-            failures.append(tex)
-    """
+            print("Warning: no /dev/shm here; building on disk as usual")
+
+    tex_files = list(discover_main_files())
+
+    patterns = getattr(args, "module", None)
+    if patterns:
+        selected, unmatched = filter_modules(
+            discover_modules(tuple(tex_files)), patterns
+        )
+        for pattern in unmatched:
+            print(f"Warning: no module matches '{pattern}'")
+        if not selected:
+            print("Nothing to build")
+            return 1
+        tex_files = [f for mod in selected.values() for f in mod.files]
+
+    cache = BuildCache()
+
+    # Cross-main references over the whole selection: used both to
+    # propagate staleness (a consumer is stale whenever its producer
+    # is about to republish) and, restricted to the stale files, to
+    # order the compilation below.
+    graph, dependents = main_file_graph(tex_files)
+
+    rebuild_all = getattr(args, "rebuild_all", False)
+    if rebuild_all:
+        # Everything is stale by decree; drop the published PDFs so a
+        # failed rebuild cannot leave outputs silently out of date.
+        _remove_published_pdfs(tex_files)
+    else:
+        # Dependency checking is IO-bound; overlap the per-file walks.
+        # One upfront scan of pdfs/ replaces a stat per candidate.
+        pdf_mtimes = scan_pdf_mtimes()
+        check_workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=check_workers) as executor:
+            stale = list(
+                executor.map(
+                    lambda t: needs_rebuild(t, cache, pdf_mtimes), tex_files
+                )
+            )
+
+        # A stale producer republishes its PDF during this run, so the
+        # mains embedding it are stale too, transitively - the per-file
+        # check cannot see that because it ran before the producer
+        # recompiled.
+        stale_set = {f for f, s in zip(tex_files, stale) if s}
+        queue = list(stale_set)
+        while queue:
+            for dependent in dependents[queue.pop()]:
+                if dependent not in stale_set:
+                    stale_set.add(dependent)
+                    queue.append(dependent)
+
+        up_to_date = [f for f in tex_files if f not in stale_set]
+        tex_files = [f for f in tex_files if f in stale_set]
+
+        if up_to_date:
+            print(f"Skipping {len(up_to_date)} up-to-date file(s)")
+
+    num_jobs = getattr(args, "jobs", None)
+    if num_jobs is None:
+        num_jobs = (os.cpu_count() or 2) - 2
+    # A non-positive count would make the semaphore wait forever.
+    num_jobs = max(1, num_jobs)
 
-    MAX_WORKERS = min(8, os.cpu_count() or 1)
-    print(f"\nCompiling with {MAX_WORKERS} parallel workers...\n")
+    # One buffered write for the listing: per-line print would grab the
+    # stdout lock and flush once per file.
+    lines = ["Found the following files to compile:"]
+    for mod in discover_modules(tex_files).values():
+        lines.append(f"  {mod.name}:")
+        lines.extend(f"     {f.relative_to(SRC_DIR)}" for f in mod.files)
+    sys.stdout.write("\n".join(lines) + "\n")
+
+    # Create every output directory once up front; fifty files in a
+    # module would otherwise each re-run the same mkdir syscall pairs.
+    out_dirs = set()
+    for tex in tex_files:
+        paths = paths_for(tex)
+        out_dirs.update((paths.build_dir, paths.pdf_dir, paths.log_dir))
+    for directory in sorted(out_dirs):
+        ensure_dir(directory)
+
+    print(f"\nCompiling with {num_jobs} parallel workers...\n")
 
     successes = []
     failures = []
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_map = {executor.submit(compile_latex, tex): tex for tex in tex_files}
-
-        for future in as_completed(future_map):
-            tex = future_map[future]
-            try:
-                ok = future.result()
-                if ok:
-                    successes.append(tex)
-                else:
-                    failures.append(tex)
-            except Exception:
+    # A main embedding another main's PDF runs after its producer;
+    # everything else is unordered. Dependents are submitted the moment
+    # their own producers finish rather than at a wave barrier, so one
+    # slow document never stalls unrelated work. Restrict the selection
+    # graph to the files actually being built.
+    building = set(tex_files)
+    graph = {t: {d for d in graph[t] if d in building} for t in tex_files}
+    dependents = {t: [d for d in dependents[t] if d in building]
+                  for t in tex_files}
+    indegree = {t: len(deps) for t, deps in graph.items()}
+
+    # Reject cyclic references before spawning anything; an exception
+    # mid-build would skip the summary and the cache save.
+    degrees = dict(indegree)
+    queue = [t for t, deg in degrees.items() if deg == 0]
+    while queue:
+        for dependent in dependents[queue.pop()]:
+            degrees[dependent] -= 1
+            if degrees[dependent] == 0:
+                queue.append(dependent)
+    stuck = sorted(t for t, deg in degrees.items() if deg > 0)
+    if stuck:
+        print(f"{RED}Error: circular references between main files:{RESET}")
+        for t in stuck:
+            print("   ", t.relative_to(SRC_DIR))
+        return 1
+
+    done = 0
+    total = len(tex_files)
+
+    extra_flags = FAST_FLAGS if getattr(args, "fast", False) else ()
+    if rebuild_all:
+        # -gg makes latexmk ignore its own up-to-date bookkeeping in
+        # build/ instead of short-circuiting to "nothing to do".
+        extra_flags = extra_flags + ("-gg",)
+
+    # One event loop drives all latexmk children directly; a semaphore
+    # caps how many run at once. No worker threads, no pickling - each
+    # "job" is just a suspended coroutine waiting on its subprocess.
+    semaphore = None
+
+    async def timed_compile(batch):
+        async with semaphore:
+            start = time.monotonic()
+            statuses = await compile_directory(batch, extra_flags)
+            return batch, statuses, time.monotonic() - start
+
+    def record(batch, statuses, duration):
+        nonlocal done
+        for tex, ok in statuses.items():
+            done += 1
+            if ok:
+                successes.append(tex)
+                cache.update(tex)
+                # Fingerprint what this build actually read, so later
+                # runs can tell a touched dependency from an edited one.
+                fls_file = paths_for(tex).fls_file
+                if fls_file.exists():
+                    for dep in parse_fls_dependencies(fls_file, tex.parent):
+                        cache.update(dep)
+                if duration is not None:
+                    cache.set_duration(tex, round(duration / len(batch), 3))
+            else:
                 failures.append(tex)
+            status = f"{GREEN}ok{RESET}    " if ok else f"{RED}FAILED{RESET}"
+            print(f"[{done}/{total}] {status} {tex.relative_to(SRC_DIR)}")
+
+        # Persist progress periodically so an interrupted run still
+        # remembers what it already built.
+        if done % 8 == 0:
+            cache.save()
+
+    async def compile_all():
+        nonlocal semaphore
+        semaphore = asyncio.Semaphore(num_jobs)
+
+        # Initially ready files, longest-first (LPT) so one slow
+        # document does not tail-end the build; mains sharing a
+        # directory compile in one latexmk call.
+        ready = [t for t in tex_files if indegree[t] == 0]
+        ready.sort(key=lambda t: cache.get_duration(t) or float("inf"),
+                   reverse=True)
+        by_dir = {}
+        for tex in ready:
+            by_dir.setdefault(tex.parent, []).append(tex)
+
+        pending = {
+            asyncio.ensure_future(timed_compile(batch))
+            for batch in by_dir.values()
+        }
+        while pending:
+            finished, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in finished:
+                batch, statuses, duration = task.result()
+                record(batch, statuses, duration)
+                # Release dependents whose producers are all done.
+                for tex in batch:
+                    for dependent in dependents[tex]:
+                        indegree[dependent] -= 1
+                        if indegree[dependent] == 0:
+                            pending.add(asyncio.ensure_future(
+                                timed_compile([dependent])
+                            ))
+
+    asyncio.run(compile_all())
+
+    cache.save()
 
     print("\n===== Compilation Summary =====")
     if successes:
@@ -143,9 +1009,73 @@ if __name__ == "__main__":
             print("   ", f)
 
     if failures:
-        print(f"\nFailed to compile: {len(failures)}")
+        print(f"\n{RED}Failed to compile: {len(failures)}{RESET}")
         for f in failures:
             print("   ", f)
-        exit(1)
-    else:
-        print("\nAll files compiled successfully")
+        return 1
+
+    print(f"\n{GREEN}All files compiled successfully{RESET}")
+    return 0
+
+
+# --------------------------------------------------
+# Main
+# --------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the course PDFs.")
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser(
+        "build", help="compile out-of-date main files (default)"
+    )
+    build_parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="parallel compile jobs (default: cpu count - 2)",
+    )
+    build_parser.add_argument(
+        "--fast", action="store_true",
+        help="iterative mode: uncompressed PDFs, no synctex",
+    )
+    build_parser.add_argument(
+        "--rebuild-all", action="store_true",
+        help="ignore up-to-date checks and recompile everything",
+    )
+    build_parser.add_argument(
+        "--ram-build", action="store_true",
+        help="keep intermediate artifacts on /dev/shm (tmpfs) when available",
+    )
+    build_parser.add_argument(
+        "-m", "--module", action="append", metavar="PATTERN",
+        help="only build matching modules (name, course code, or substring); repeatable",
+    )
+    subparsers.add_parser("list", help="list modules and their main files")
+    subparsers.add_parser("stats", help="show project statistics")
+    clean_parser = subparsers.add_parser("clean", help="remove build artifacts")
+    clean_parser.add_argument(
+        "--deep", action="store_true",
+        help="also remove build/ (forces full recompiles next run)",
+    )
+    clean_parser.add_argument(
+        "--pdfs", action="store_true", help="also remove generated PDFs"
+    )
+    parser.add_argument(
+        "--export-cache",
+        action="store_true",
+        help="print the build cache as JSON and exit (debugging)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.export_cache:
+        print(BuildCache().export_json())
+        return 0
+    if args.command == "list":
+        return list_command(args)
+    if args.command == "stats":
+        return stats_command(args)
+    if args.command == "clean":
+        return clean_command(args)
+    return build_command(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())